@@ -1,11 +1,12 @@
 """Session-based auth helpers for the web UI."""
+import inspect
 import os
+from collections import namedtuple
 from functools import wraps
 from typing import Callable
 
 from fastapi import Request
 from fastapi.responses import RedirectResponse
-from starlette.middleware.sessions import SessionMiddleware
 
 SESSION_SECRET = os.getenv("SESSION_SECRET", "change-this-secret")
 
@@ -15,15 +16,42 @@ def check_credentials(username: str, password: str) -> bool:
     return verify_user(username, password)
 
 
+SessionCtx = namedtuple("SessionCtx", "gh_token gh_username username")
+
+
+async def session_ctx(request: Request) -> SessionCtx:
+    """Dependency: the session values UI handlers read, pulled out once per request.
+
+    Async on purpose — a sync dependency would cost a threadpool hop per request.
+    """
+    session = request.session
+    return SessionCtx(
+        gh_token=session.get("github_token", ""),
+        gh_username=session.get("github_username", ""),
+        username=session.get("username", ""),
+    )
+
+
 def is_logged_in(request: Request) -> bool:
     return request.session.get("authenticated") is True
 
 
 def require_login(func: Callable):
-    """Decorator for UI route handlers — redirects to /login if not authed."""
+    """Decorator for UI route handlers — redirects to /login if not authed.
+
+    Sync handlers keep a sync wrapper, so FastAPI still runs them in its threadpool.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(request: Request, *args, **kwargs):
+            if not is_logged_in(request):
+                return RedirectResponse("/login", status_code=302)
+            return await func(request, *args, **kwargs)
+        return wrapper
+
     @wraps(func)
-    async def wrapper(request: Request, *args, **kwargs):
+    def sync_wrapper(request: Request, *args, **kwargs):
         if not is_logged_in(request):
             return RedirectResponse("/login", status_code=302)
-        return await func(request, *args, **kwargs)
-    return wrapper
+        return func(request, *args, **kwargs)
+    return sync_wrapper
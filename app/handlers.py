@@ -1,14 +1,18 @@
 """Container deploy logic triggered by GitHub webhook events."""
+import asyncio
+import hashlib
 import logging
 import os
 import shlex
 import subprocess
+import time
 from datetime import datetime, timezone
+from typing import Optional
 
-import requests as http_requests
+import httpx
 
 from app import models
-from app.utils import parse_env_file
+from app.utils import env_pairs
 
 log = logging.getLogger("deployhook")
 
@@ -16,29 +20,157 @@ _COLOUR_OK   = 0x00a0f0   # electric blue
 _COLOUR_FAIL = 0xf85149   # red
 _COLOUR_INFO = 0x58a6ff   # blue
 
+# Failed docker pulls/runs can dump megabytes of output; keep only the tail
+_DETAIL_MAX = 4000
+
 
 # ---------------------------------------------------------------------------
 # Discord
 # ---------------------------------------------------------------------------
 
-def _discord_embed(embeds: list):
-    """Post one or more embed objects to Discord."""
+# Shared client so repeated notifications reuse the TLS connection to Discord
+_http = httpx.AsyncClient(
+    timeout=5.0,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=4),
+)
+
+
+# (url, monotonic time fetched) — saves a settings read on every notification
+_webhook_cache: tuple[str, float] = ("", 0.0)
+_WEBHOOK_TTL = 30
+
+
+def _get_webhook_url() -> str:
+    global _webhook_cache
+    url, fetched = _webhook_cache
+    if fetched and time.monotonic() - fetched < _WEBHOOK_TTL:
+        return url
     url = models.get_setting("DISCORD_WEBHOOK_URL", "")
+    _webhook_cache = (url, time.monotonic())
+    return url
+
+
+def forget_webhook_url():
+    """Drop the cached Discord URL (call after the setting changes)."""
+    global _webhook_cache
+    _webhook_cache = ("", 0.0)
+
+
+def _check_discord(r: httpx.Response):
+    """Log a rejected webhook post — Discord drops the whole message on 4xx/5xx."""
+    if r.status_code == 429:
+        log.warning("Discord rate-limited the webhook (retry after %ss); message dropped",
+                    r.headers.get("retry-after", "?"))
+    elif r.status_code >= 300:
+        log.warning("Discord rejected message: HTTP %s %s", r.status_code, r.text[:200])
+
+
+async def _discord_embed(embeds: list):
+    """Post one or more embed objects to Discord."""
+    url = _get_webhook_url()
     if not url:
         return
     try:
-        http_requests.post(
-            url,
-            json={"embeds": embeds},
-            timeout=5,
-        )
+        r = await _http.post(url, json={"embeds": embeds})
     except Exception as exc:
         log.warning("Discord send failed: %s", exc)
+        return
+    _check_discord(r)
+
+
+def _embed_chars(embed: dict) -> int:
+    """Characters Discord counts against the per-message embed text limit."""
+    n = len(embed.get("title", "")) + len(embed.get("description", ""))
+    for field in embed.get("fields", ()):
+        n += len(field["name"]) + len(field["value"])
+    return n
+
+
+class _DiscordBatcher:
+    """Coalesce embeds fired within a short window into a single webhook POST.
+
+    A fan-out deploy of N repos would otherwise send 2N separate messages and
+    run straight into Discord's rate limit.
+    """
+    MAX_EMBEDS = 10     # Discord's per-message embed limit
+    MAX_CHARS  = 6000   # Discord's limit on embed text summed over one message
+    WINDOW     = 0.2    # seconds to keep collecting after the first embed
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._carry: Optional[dict] = None   # embed that didn't fit the last batch
+
+    def put(self, embed: dict):
+        """Queue an embed; the sender task is started on first use."""
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        self.queue.put_nowait(embed)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = await self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            chars = _embed_chars(first)
+            deadline = loop.time() + self.WINDOW
+            closing = False
+            while len(batch) < self.MAX_EMBEDS:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    embed = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if embed is None:
+                    closing = True
+                    break
+                size = _embed_chars(embed)
+                if chars + size > self.MAX_CHARS:
+                    self._carry = embed   # opens the next message
+                    break
+                batch.append(embed)
+                chars += size
+            await self._send(batch)
+            if closing:
+                return
+
+    async def _send(self, batch: list):
+        # One timestamp per message; embeds in a batch are at most WINDOW apart
+        ts = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        for embed in batch:
+            embed["timestamp"] = ts
+        await _discord_embed(batch)
+
+    async def aclose(self):
+        """Flush whatever is still queued, then stop the sender task."""
+        if self._task is None or self._task.done():
+            return
+        self.queue.put_nowait(None)   # sentinel: drain and exit
+        await self._task
+        self._task = None
+
+
+_batcher = _DiscordBatcher()
+
+
+async def close_notifier():
+    """Flush pending Discord embeds and close the HTTP client (app shutdown)."""
+    await _batcher.aclose()
+    await _http.aclose()
 
 
 def notify_deploy_start(github_repo: str, container_name: str, image: str):
     log.info("Deploy started: %s → %s  [%s]", github_repo, container_name, image)
-    _discord_embed([{
+    _batcher.put({
         "title": f"⏳ Deploying `{container_name}`",
         "color": _COLOUR_INFO,
         "fields": [
@@ -46,13 +178,12 @@ def notify_deploy_start(github_repo: str, container_name: str, image: str):
             {"name": "Container",   "value": container_name, "inline": True},
             {"name": "Image",       "value": f"`{image}`",   "inline": False},
         ],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }])
+    })
 
 
 def notify_deploy_ok(github_repo: str, container_name: str, image: str):
     log.info("Deploy succeeded: %s → %s", github_repo, container_name)
-    _discord_embed([{
+    _batcher.put({
         "title": f"✅ Deployed `{container_name}`",
         "color": _COLOUR_OK,
         "fields": [
@@ -60,88 +191,170 @@ def notify_deploy_ok(github_repo: str, container_name: str, image: str):
             {"name": "Container",   "value": container_name, "inline": True},
             {"name": "Image",       "value": f"`{image}`",   "inline": False},
         ],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }])
+    })
 
 
 def notify_deploy_fail(github_repo: str, container_name: str, error: str):
-    log.error("Deploy failed: %s  error: %s", github_repo, error)
-    _discord_embed([{
+    log.error("Deploy failed: %s  error: %s", github_repo, error[-_DETAIL_MAX:])
+    _batcher.put({
         "title": f"❌ Deploy Failed: `{container_name}`",
         "color": _COLOUR_FAIL,
         "fields": [
             {"name": "Repository", "value": github_repo,    "inline": True},
             {"name": "Container",  "value": container_name, "inline": True},
-            {"name": "Error",      "value": f"```{error[:900]}```", "inline": False},
+            {"name": "Error",      "value": f"```{error[-900:]}```", "inline": False},
         ],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }])
+    })
 
 
 # Keep a plain helper for one-off messages
-def notify(msg: str):
+async def notify(msg: str):
     log.info("%s", msg)
-    url = models.get_setting("DISCORD_WEBHOOK_URL", "")
+    url = _get_webhook_url()
     if url:
         try:
-            http_requests.post(url, json={"content": msg}, timeout=5)
+            r = await _http.post(url, json={"content": msg})
         except Exception:
-            pass
+            return
+        _check_discord(r)
 
 
 # ---------------------------------------------------------------------------
 # Docker helpers
 # ---------------------------------------------------------------------------
 
-def docker_login():
-    creds    = models.load_github_creds()
-    username = creds.get("username") or models.get_setting("GHCR_USERNAME", "")
-    token    = creds.get("token")    or models.get_setting("GHCR_PAT", "")
-    if not username or not token:
-        raise RuntimeError(
-            "No GHCR credentials available. Connect GitHub in the UI "
-            "(Browse GitHub → connect), or set GHCR_USERNAME/GHCR_PAT in .env."
+async def run_docker(
+    *args: str,
+    input: Optional[str] = None,
+    merge_stderr: bool = False,
+    timeout: Optional[float] = None,
+) -> subprocess.CompletedProcess:
+    """Run a docker CLI command without blocking the event loop.
+
+    merge_stderr interleaves stderr into stdout (keeps `docker logs` ordered).
+    On timeout the process is killed and asyncio.TimeoutError propagates.
+    """
+    argv = ["docker", *args]
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+    )
+    try:
+        out, err = await asyncio.wait_for(
+            proc.communicate(input.encode() if input is not None else None), timeout,
         )
-    r = subprocess.run(
-        ["docker", "login", "ghcr.io", "-u", username, "--password-stdin"],
-        input=token, text=True, capture_output=True,
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return subprocess.CompletedProcess(
+        argv, proc.returncode,
+        out.decode(errors="replace"), (err or b"").decode(errors="replace"),
     )
-    if r.returncode != 0:
-        detail = (r.stderr or r.stdout or "no output").strip()
-        raise RuntimeError(f"docker login failed: {detail}")
 
 
-def container_running(name: str) -> bool:
-    r = subprocess.run(
-        ["docker", "ps", "-a", "--filter", f"name=^{name}$", "--format", "{{.Names}}"],
-        capture_output=True, text=True,
-    )
-    return name in r.stdout
+def _failure_detail(r: subprocess.CompletedProcess) -> str:
+    """Tail of a failed command's output — the actual error is at the end."""
+    return (r.stderr or r.stdout or "no output").strip()[-_DETAIL_MAX:]
+
+
+# One lock per image reference so concurrent deploys never pull the same tag twice
+_pull_locks: dict[str, asyncio.Lock] = {}
+
+
+def _pull_lock(image: str) -> asyncio.Lock:
+    # No await between lookup and insert, so this is race-free on the event loop
+    return _pull_locks.setdefault(image, asyncio.Lock())
+
+
+# One lock per container name: two deploys of the same container (two workflows,
+# or a webhook plus a manual deploy) must not interleave their stop/rm/run
+_container_locks: dict[str, asyncio.Lock] = {}
+
+
+def _container_lock(name: str) -> asyncio.Lock:
+    return _container_locks.setdefault(name, asyncio.Lock())
 
 
-def prune_old_images(image_repo: str):
+# (username, sha256 of credentials, monotonic time) of the last successful login
+_last_login: Optional[tuple[str, str, float]] = None
+_LOGIN_TTL = 3600
+_login_lock = asyncio.Lock()
+
+
+def _forget_login():
+    global _last_login
+    _last_login = None
+
+
+async def docker_login():
+    global _last_login
+    creds    = models.load_github_creds()
+    settings = models.load_app_settings()
+    username = creds.get("username") or models.get_setting("GHCR_USERNAME", "", settings)
+    token    = creds.get("token")    or models.get_setting("GHCR_PAT", "", settings)
+    if not username or not token:
+        raise RuntimeError(
+            "No GHCR credentials available. Connect GitHub in the UI "
+            "(Browse GitHub → connect), or set GHCR_USERNAME/GHCR_PAT in .env."
+        )
+    cred_hash = hashlib.sha256(f"{username}:{token}".encode()).hexdigest()
+    # Concurrent deploys wait here so only the first one actually logs in
+    async with _login_lock:
+        if (
+            _last_login
+            and _last_login[0] == username
+            and _last_login[1] == cred_hash
+            and time.monotonic() - _last_login[2] < _LOGIN_TTL
+        ):
+            return
+        r = await run_docker("login", "ghcr.io", "-u", username, "--password-stdin", input=token)
+        if r.returncode != 0:
+            _last_login = None
+            detail = _failure_detail(r)
+            raise RuntimeError(f"docker login failed: {detail}")
+        _last_login = (username, cred_hash, time.monotonic())
+
+
+async def container_running(name: str) -> bool:
+    """True if a container with this exact name exists (running or stopped)."""
+    # Direct lookup by name — exits non-zero when missing, no container table scan
+    r = await run_docker("container", "inspect", "--format", "{{.Id}}", name)
+    return r.returncode == 0
+
+
+async def prune_old_images(image_repo: str):
     try:
-        r = subprocess.run(
-            ["docker", "images", "--format", "{{.ID}} {{.Repository}}:{{.Tag}}"],
-            capture_output=True, text=True, check=True,
+        # Let the daemon filter to this repository instead of listing every image
+        r = await run_docker(
+            "images",
+            "--filter", f"reference={image_repo}",
+            "--filter", "dangling=false",
+            "--format", "{{.ID}} {{.Repository}}:{{.Tag}}",
         )
+        if r.returncode != 0:
+            raise RuntimeError((r.stderr or "docker images failed").strip())
         ids = [
             line.split()[0]
             for line in r.stdout.strip().splitlines()
-            if image_repo in line and not line.endswith(":latest")
+            if not line.endswith(":latest")
         ]
         if ids:
-            subprocess.run(["docker", "rmi", "-f"] + ids, check=True)
-        subprocess.run(["docker", "image", "prune", "-f"], capture_output=True)
+            rmi = await run_docker("rmi", "-f", *ids)
+            if rmi.returncode != 0:
+                raise RuntimeError((rmi.stderr or "docker rmi failed").strip())
+        await run_docker("image", "prune", "-f")
     except Exception as e:
-        notify(f"Warning: prune failed — {e}")
+        await notify(f"Warning: prune failed — {e}")
 
 
 # ---------------------------------------------------------------------------
 # Core deploy
 # ---------------------------------------------------------------------------
 
-def deploy(repo: dict, head_branch: str = ""):
+async def deploy(repo: dict, head_branch: str = ""):
     """Pull + re-launch a single container described by a repo dict."""
     repo_id        = repo["id"]
     github_repo    = repo["github_repo"]
@@ -156,23 +369,22 @@ def deploy(repo: dict, head_branch: str = ""):
 
     notify_deploy_start(github_repo, container_name, image)
 
-    docker_login()
+    await docker_login()
 
-    pull = subprocess.run(
-        ["docker", "pull", image],
-        capture_output=True, text=True,
-    )
+    # Only the pull is serialised; stop/rm/run for other repos interleave freely
+    async with _pull_lock(image):
+        pull = await run_docker("pull", image)
     if pull.returncode != 0:
-        detail = (pull.stderr or pull.stdout or "no output").strip()
+        _forget_login()   # cached login may have gone stale — redo it next time
+        detail = _failure_detail(pull)
         raise RuntimeError(f"docker pull failed: {detail}")
 
     # Log image creation date and tags after a successful pull
     try:
         import json as _json
-        inspect = subprocess.run(
-            ["docker", "inspect", "--format",
-             '{"created":"{{.Created}}","tags":{{json .RepoTags}}}', image],
-            capture_output=True, text=True,
+        inspect = await run_docker(
+            "inspect", "--format",
+            '{"created":"{{.Created}}","tags":{{json .RepoTags}}}', image,
         )
         if inspect.returncode == 0 and inspect.stdout.strip():
             meta = _json.loads(inspect.stdout.strip())
@@ -202,11 +414,7 @@ def deploy(repo: dict, head_branch: str = ""):
     except Exception as _exc:
         log.debug("Could not read image metadata: %s", _exc)
 
-    if container_running(container_name):
-        subprocess.run(["docker", "stop", container_name], capture_output=True)
-        subprocess.run(["docker", "rm",   "-f", container_name], capture_output=True)
-
-    cmd = ["docker", "run", "-d", "--name", container_name, "--restart", "unless-stopped"]
+    cmd = ["run", "-d", "--name", container_name, "--restart", "unless-stopped"]
 
     if ports:
         cmd += ["-p", ports]
@@ -214,24 +422,30 @@ def deploy(repo: dict, head_branch: str = ""):
     for vol in volumes:
         cmd += ["-v", vol]
 
-    # Inject any extra docker run flags (one flag expression per line)
-    for flag_line in extra_flags:
-        cmd += shlex.split(flag_line)
+    # Inject any extra docker run flags — tokenized when the repo was saved
+    flag_tokens = repo.get("extra_flags_tokens")
+    if flag_tokens is None:
+        # Row saved before tokens were stored: fall back to splitting here
+        flag_tokens = [tok for line in extra_flags for tok in shlex.split(line)]
+    cmd.extend(flag_tokens)
 
     # Inject plain env vars from the stored .env file for this repo
     env_content = models.read_env_content(repo_id)
     if env_content:
-        for k, v in parse_env_file(env_content).items():
-            cmd += ["-e", f"{k}={v}"]
+        cmd.extend(arg for k, v in env_pairs(env_content) for arg in ("-e", f"{k}={v}"))
 
     cmd.append(image)
-    run_result = subprocess.run(cmd, capture_output=True, text=True)
+    async with _container_lock(container_name):
+        if await container_running(container_name):
+            await run_docker("stop", container_name)
+            await run_docker("rm",   "-f", container_name)
+        run_result = await run_docker(*cmd)
     if run_result.returncode != 0:
-        detail = (run_result.stderr or run_result.stdout or "no output").strip()
+        detail = _failure_detail(run_result)
         raise RuntimeError(f"docker run failed: {detail}")
 
     models.touch_last_deployed(repo_id)
-    prune_old_images(image.rsplit(":", 1)[0])
+    await prune_old_images(image.rsplit(":", 1)[0])
     notify_deploy_ok(github_repo, container_name, image)
 
 
@@ -239,7 +453,19 @@ def deploy(repo: dict, head_branch: str = ""):
 # Webhook entry point
 # ---------------------------------------------------------------------------
 
-async def handle_payload(raw_body: bytes):
+class FanoutError(RuntimeError):
+    """Some deploys of a fan-out failed; failed_ids are the repo ids to retry."""
+
+    def __init__(self, message: str, failed_ids: list[str]):
+        super().__init__(message)
+        self.failed_ids = failed_ids
+
+
+async def handle_payload(raw_body: bytes, only: Optional[set[str]] = None):
+    """Deploy whatever a signature-verified workflow_run payload asks for.
+
+    only restricts the fan-out to those repo ids (a retry of the ones that failed).
+    """
     import json
     if not raw_body.strip():
         return
@@ -253,23 +479,109 @@ async def handle_payload(raw_body: bytes):
     if action != "completed" or conclusion != "success":
         return
 
-    repo = models.get_repo_by_full_name(full_name)
-    if repo is None:
+    # Several tracked entries may point at the same GitHub repo; deploy them concurrently
+    repos = []
+    for repo in models.list_repos_by_full_name(full_name):
+        if only is not None and repo["id"] not in only:
+            continue
+        # If the repo has a branch filter configured, skip other branches
+        configured_branch = repo.get("branch", "").strip()
+        if configured_branch and head_branch != configured_branch:
+            log.debug(
+                "Skipping deploy for %s: webhook branch '%s' != configured '%s'",
+                full_name, head_branch, configured_branch,
+            )
+            continue
+        repos.append(repo)
+    if not repos:
         return
 
-    # If the repo has a branch filter configured, skip other branches
-    configured_branch = repo.get("branch", "").strip()
-    if configured_branch and head_branch != configured_branch:
-        log.debug(
-            "Skipping deploy for %s: webhook branch '%s' != configured '%s'",
-            full_name, head_branch, configured_branch,
-        )
+    results = await asyncio.gather(
+        *(deploy(r, head_branch=head_branch) for r in repos),
+        return_exceptions=True,
+    )
+    errors = []
+    for repo, result in zip(repos, results):
+        if isinstance(result, Exception):
+            notify_deploy_fail(full_name, repo.get("container_name", "?"), str(result)[-900:])
+            errors.append((repo["id"], result))
+    if errors:
+        raise FanoutError(str(errors[0][1]), [rid for rid, _ in errors]) from errors[0][1]
+
+
+# ---------------------------------------------------------------------------
+# Queued webhook worker
+# ---------------------------------------------------------------------------
+
+_EVENT_CONCURRENCY = 16    # events deployed at the same time
+_EVENT_MAX_TRIES   = 3
+_EVENT_BACKOFF     = 30    # seconds before the first retry; doubles each time
+_EVENT_POLL        = 5     # idle wake-up so due retries are picked up
+_EVENT_PURGE_EVERY = 3600
+
+_events_ready = asyncio.Event()
+_inflight: set[asyncio.Task] = set()
+
+
+async def enqueue_payload(raw_body: bytes):
+    """Persist a verified webhook body for the worker and return immediately."""
+    if not raw_body.strip():
         return
+    # The INSERT commits (and fsyncs) — keep that off the loop during a burst
+    await asyncio.to_thread(models.enqueue_event, raw_body)
+    _events_ready.set()
+
 
+async def _process_event(event: dict):
     try:
-        deploy(repo, head_branch=head_branch)
-    except subprocess.CalledProcessError as e:
-        notify_deploy_fail(full_name, repo.get("container_name", "?"), str(e))
+        await handle_payload(event["body"], event["failed_repos"])
     except Exception as e:
-        notify_deploy_fail(full_name, repo.get("container_name", "?"), str(e))
-        raise
+        attempts = event["attempts"] + 1
+        retry_in = None if attempts >= _EVENT_MAX_TRIES else _EVENT_BACKOFF * 2 ** (attempts - 1)
+        # Retry only the repos that failed; anything else (bad payload…) retries them all
+        failed = e.failed_ids if isinstance(e, FanoutError) else None
+        models.fail_event(event["id"], attempts, str(e)[-_DETAIL_MAX:], retry_in, failed)
+        if retry_in is None:
+            log.error("Webhook event %s failed after %d attempts", event["id"], attempts)
+        else:
+            log.warning("Webhook event %s failed (attempt %d), retrying in %ds",
+                        event["id"], attempts, retry_in)
+    else:
+        models.finish_event(event["id"])
+
+
+def _event_done(task: asyncio.Task):
+    _inflight.discard(task)
+    _events_ready.set()   # a slot is free — look for more work
+
+
+async def run_event_worker():
+    """Deploy queued webhook events forever. Started from the app lifespan."""
+    replayed = models.requeue_running_events()
+    if replayed:
+        log.info("Replaying %d webhook event(s) interrupted by a restart", replayed)
+    last_purge = 0.0
+    try:
+        while True:
+            _events_ready.clear()
+            try:
+                free = _EVENT_CONCURRENCY - len(_inflight)
+                if free > 0:
+                    for event in models.claim_events(free):
+                        task = asyncio.create_task(_process_event(event))
+                        _inflight.add(task)
+                        task.add_done_callback(_event_done)
+                if time.monotonic() - last_purge > _EVENT_PURGE_EVERY:
+                    models.purge_events()
+                    last_purge = time.monotonic()
+            except Exception:
+                log.exception("Webhook event worker error")
+            try:
+                await asyncio.wait_for(_events_ready.wait(), _EVENT_POLL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # Shutdown: abandon in-flight deploys; their events replay on next start
+        for task in list(_inflight):
+            task.cancel()
+        await asyncio.gather(*_inflight, return_exceptions=True)
@@ -2,33 +2,127 @@
 In-memory log ring buffer + optional file sink.
 
 Call setup() once at startup. All loggers (including uvicorn) will feed here.
+Records are handed to a QueueListener thread, so request handlers only pay
+for merging msg % args and a queue put; formatting, tracebacks and sink I/O
+happen on the listener thread.
 """
 import logging
 import os
+import queue
 import sys
+import threading
+import time
 from collections import deque
-from logging.handlers import RotatingFileHandler
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
 
 MAX_LINES = 1000
 
 _buffer: deque = deque(maxlen=MAX_LINES)
+_gen = 0                       # lines ever appended; pollers pass it back as `since`
+_gen_lock = threading.Lock()   # keeps _buffer and _gen consistent for readers
 
 _LOG_FILE = "/app/data/app.log"
 
+_listener: Optional[QueueListener] = None
+_flush_stop = threading.Event()
+
+
+class _LocalQueueHandler(QueueHandler):
+    """QueueHandler for an in-process queue: skip the format-and-copy in prepare().
+
+    The stock prepare() formats the record (traceback included) and copies it
+    so it can be pickled. Nothing here leaves the process, so only msg/args are
+    merged, since args may be mutated after the call returns. The listener's
+    sinks do the formatting.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 
 class _BufferHandler(logging.Handler):
     def emit(self, record: logging.LogRecord):
+        global _gen
         try:
-            _buffer.append(self.format(record))
+            line = self.format(record)
         except Exception:
-            pass
+            return
+        with _gen_lock:
+            _buffer.append(line)
+            _gen += 1
+
+
+class _BufferedFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that buffers writes and flushes at most once a second.
+
+    The stock handler flushes after every record. Under log bursts that
+    turns each line into a write syscall on the listener thread. Its size
+    check also calls stream.tell(), which flushes a text stream, so the file
+    size is tracked here instead.
+    """
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, *args, **kwargs):
+        self._last_flush = time.monotonic()
+        super().__init__(*args, **kwargs)
+        try:
+            self._size = os.path.getsize(self.baseFilename)
+        except OSError:
+            self._size = 0
 
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.maxBytes <= 0:
+            return False
+        n = len(self.format(record).encode(self.encoding or "utf-8", "replace")) + 1
+        roll = self._size > 0 and self._size + n >= self.maxBytes
+        # After a rollover this record is the first line of the new file
+        self._size = n if roll else self._size + n
+        return roll
 
-def get_lines() -> list[str]:
-    return list(_buffer)
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=8192,
+                    encoding=self.encoding, errors=self.errors)
+
+    def flush(self):
+        # Called by StreamHandler.emit() after each record — rate-limit it
+        if time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.force_flush()
+
+    def force_flush(self):
+        super().flush()
+        self._last_flush = time.monotonic()
+
+
+def _flush_loop(handler: _BufferedFileHandler, stop: threading.Event):
+    """Push out buffered lines when no new record arrives to trigger a flush."""
+    while not stop.wait(_BufferedFileHandler.FLUSH_INTERVAL):
+        handler.force_flush()
+
+
+def get_lines(since: Optional[int] = None) -> tuple[list[str], int, bool]:
+    """Return (lines, gen, reset).
+
+    With `since` set to a previously returned gen, only the lines appended
+    after it are returned. reset is True when the full buffer is returned
+    instead: on first fetch, after a restart, or when the caller fell so far
+    behind that lines were dropped from the ring.
+    """
+    with _gen_lock:
+        gen = _gen
+        if since is None or since > gen or gen - since > len(_buffer):
+            return list(_buffer), gen, True
+        # Walk back from the newest entry so the cost is O(new lines)
+        new = list(islice(reversed(_buffer), gen - since))
+    new.reverse()
+    return new, gen, False
 
 
 def setup():
+    global _listener
     fmt = logging.Formatter("%(asctime)s %(levelname)-8s %(name)s: %(message)s",
                             datefmt="%Y-%m-%d %H:%M:%S")
 
@@ -37,20 +131,39 @@ def setup():
 
     # Optional file sink (rotates at 2 MB, keeps 2 backups)
     os.makedirs(os.path.dirname(_LOG_FILE), exist_ok=True)
-    file_handler = RotatingFileHandler(_LOG_FILE, maxBytes=2_000_000, backupCount=2)
+    file_handler = _BufferedFileHandler(_LOG_FILE, maxBytes=2_000_000, backupCount=2)
     file_handler.setFormatter(fmt)
+    threading.Thread(target=_flush_loop, args=(file_handler, _flush_stop),
+                     name="log-flush", daemon=True).start()
 
     # stdout sink so `docker logs` captures output
     stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setFormatter(fmt)
 
+    # The root logger only enqueues; the listener thread fans out to the sinks
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, buf_handler, file_handler, stdout_handler,
+                              respect_handler_level=True)
+    _listener.start()
+
     root = logging.getLogger()
     root.setLevel(logging.INFO)
-    for h in (buf_handler, file_handler, stdout_handler):
-        root.addHandler(h)
+    root.addHandler(_LocalQueueHandler(log_queue))
 
     # Pull uvicorn's own loggers into the same handlers
     for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
         uv = logging.getLogger(name)
         uv.handlers.clear()
         uv.propagate = True   # let root handle it
+
+
+def shutdown():
+    """Flush queued records to the sinks and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _flush_stop.set()
+    for h in _listener.handlers:
+        getattr(h, "force_flush", h.flush)()
+    _listener = None
@@ -1,25 +1,55 @@
 import asyncio
+import hashlib
+import logging
 import os
 import secrets
-import subprocess
+import ssl
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 from urllib.parse import urlencode
 
-import requests as http_requests
-from fastapi import FastAPI, Request, Header, Form
+import anyio.to_thread
+import httpx
+from fastapi import Depends, FastAPI, Request, Header, Form
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from pydantic import BaseModel
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.middleware.sessions import SessionMiddleware
 
 from app import models
 from app import log_buffer as _log_buffer
-from app.auth import SESSION_SECRET, check_credentials, is_logged_in, require_login
-from app.handlers import handle_payload
+from app.auth import (
+    SESSION_SECRET, SessionCtx, check_credentials, is_logged_in, require_login, session_ctx,
+)
+from app.handlers import (
+    close_notifier, enqueue_payload, forget_webhook_url, run_docker, run_event_worker,
+)
 from app.models import clear_github_creds, load_github_creds, save_github_creds
+from app.sessions import ServerSessionMiddleware
 from app.utils import verify_signature
 
-app = FastAPI(docs_url=None, redoc_url=None)
+
+_THREAD_TOKENS = 100
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Sync endpoints (form submits, password hashing) run on this pool; default is 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = _THREAD_TOKENS
+    worker = asyncio.create_task(run_event_worker())
+    yield
+    worker.cancel()   # unfinished events stay 'running' and replay on next start
+    await asyncio.gather(worker, return_exceptions=True)
+    await close_notifier()
+    await _gh_client.aclose()
+    models.close_db()
+    _log_buffer.shutdown()
+
+
+app = FastAPI(docs_url=None, redoc_url=None, lifespan=_lifespan)
 _log_buffer.setup()   # capture app + uvicorn logs into the ring buffer
 _initial_password = models.bootstrap_users()
 if _initial_password:
@@ -36,7 +66,12 @@ if _initial_password:
     )
     print(_banner, flush=True)
 
-app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET, max_age=86400)
+# Login cost depends on the OpenSSL build behind hashlib — record it once
+logging.getLogger("deployhook").info(
+    "Password hashing: PBKDF2-SHA256 x%d via %s", models.PW_HASH_ITERATIONS, ssl.OPENSSL_VERSION,
+)
+
+app.add_middleware(ServerSessionMiddleware, secret_key=SESSION_SECRET, max_age=86400)
 
 
 # ────────────────────────────────────────────────────────────────────────────
@@ -46,18 +81,13 @@ app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET, max_age=86400)
 class _DynamicWebhookMiddleware(BaseHTTPMiddleware):
     """Forward POST requests at the custom webhook path to the real /webhook handler."""
     async def dispatch(self, request: Request, call_next):
-        ui = models.get_ui_context()
-        custom = ui.get("webhook_path", "/webhook").rstrip("/") or "/webhook"
-        if (
-            request.method == "POST"
-            and custom != "/webhook"
-            and request.url.path.rstrip("/") == custom
-        ):
+        # One set lookup; _refresh_ui_globals() keeps the set current
+        if request.method == "POST" and request.url.path in _custom_webhook_paths:
             body = await request.body()
             sig  = request.headers.get("x-hub-signature-256")
             try:
                 verify_signature(sig, body)
-                await handle_payload(body)
+                await enqueue_payload(body)
                 return JSONResponse({"status": "ok"})
             except Exception as exc:
                 return JSONResponse({"error": str(exc)}, status_code=400)
@@ -70,14 +100,65 @@ _base = os.path.dirname(__file__)
 app.mount("/static", StaticFiles(directory=os.path.join(_base, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(_base, "templates"))
 
+# Compiled templates survive restarts, so the first page load doesn't re-parse them.
+# No directory argument: Jinja then uses a per-user, 0700, owner-checked temp dir,
+# so nobody else can plant bytecode for it to load.
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+# Paths the middleware answers as webhooks, with and without a trailing slash.
+# Empty while the path is the default /webhook, which has its own route.
+_custom_webhook_paths: frozenset[str] = frozenset()
+
+
 # Inject UI customisation as a Jinja2 global so every template gets it for free
 def _refresh_ui_globals():
-    templates.env.globals["ui"] = models.get_ui_context()
+    global _custom_webhook_paths
+    ui = models.get_ui_context()
+    templates.env.globals["ui"] = ui
+    custom = ui.get("webhook_path", "/webhook").rstrip("/") or "/webhook"
+    _custom_webhook_paths = frozenset() if custom == "/webhook" else frozenset({custom, custom + "/"})
 
 _refresh_ui_globals()
 
 GITHUB_TOKEN         = os.getenv("GITHUB_TOKEN", os.getenv("GHCR_PAT", ""))
 
+# Shared async client for GitHub API/OAuth calls — keeps connections warm and
+# never blocks the event loop while GitHub responds
+_gh_client = httpx.AsyncClient(
+    timeout=10,
+    http2=True,
+    headers={"Accept": "application/vnd.github+json"},
+    # GitHub answers renamed/transferred repos with a 301; httpx only drops
+    # Authorization when a redirect leaves the origin
+    follow_redirects=True,
+)
+
+# Short-lived cache of GitHub API results: key -> (monotonic expiry, value)
+_gh_cache: dict[str, tuple[float, object]] = {}
+_GH_CACHE_MAX = 512
+
+
+def _gh_cache_get(key: str):
+    hit = _gh_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _gh_cache_put(key: str, value, ttl: float):
+    now = time.monotonic()
+    if len(_gh_cache) >= _GH_CACHE_MAX:
+        for k in [k for k, (exp, _) in _gh_cache.items() if exp <= now]:
+            del _gh_cache[k]
+        if len(_gh_cache) >= _GH_CACHE_MAX:
+            _gh_cache.clear()
+    _gh_cache[key] = (now + ttl, value)
+
+
+def _token_key(token: str) -> str:
+    """Cache-key fragment for a GitHub token, so cached results never cross accounts."""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
 
 def _get_effective_token(request: Request) -> str:
     """Return the best available GitHub token: session > persisted > env."""
@@ -102,9 +183,9 @@ async def login_page(request: Request):
 
 
 @app.post("/login", response_class=HTMLResponse)
-async def login_submit(request: Request,
-                        username: str = Form(...),
-                        password: str = Form(...)):
+def login_submit(request: Request,
+                 username: str = Form(...),
+                 password: str = Form(...)):
     if check_credentials(username, password):
         request.session["authenticated"] = True
         request.session["username"] = username
@@ -127,8 +208,9 @@ async def logout(request: Request):
 @require_login
 async def github_oauth_start(request: Request):
     """Begin GitHub OAuth flow. Redirects to GitHub login/authorize."""
-    client_id  = models.get_setting("GITHUB_CLIENT_ID", "")
-    app_base   = models.get_setting("APP_BASE_URL", "http://localhost:3002").rstrip("/")
+    settings   = models.load_app_settings()
+    client_id  = models.get_setting("GITHUB_CLIENT_ID", "", settings)
+    app_base   = models.get_setting("APP_BASE_URL", "http://localhost:3002", settings).rstrip("/")
     if not client_id:
         return HTMLResponse(
             "<p>GITHUB_CLIENT_ID is not set. Configure it in Settings.</p>",
@@ -155,19 +237,19 @@ async def github_oauth_callback(request: Request, code: str = "", state: str = "
         return HTMLResponse("<p>OAuth state mismatch. Please try again.</p>", status_code=400)
 
     # Exchange code for access token
-    app_base = models.get_setting("APP_BASE_URL", "http://localhost:3002").rstrip("/")
-    r = http_requests.post(
+    settings = models.load_app_settings()
+    app_base = models.get_setting("APP_BASE_URL", "http://localhost:3002", settings).rstrip("/")
+    r = await _gh_client.post(
         "https://github.com/login/oauth/access_token",
         data={
-            "client_id":     models.get_setting("GITHUB_CLIENT_ID", ""),
-            "client_secret": models.get_setting("GITHUB_CLIENT_SECRET", ""),
+            "client_id":     models.get_setting("GITHUB_CLIENT_ID", "", settings),
+            "client_secret": models.get_setting("GITHUB_CLIENT_SECRET", "", settings),
             "code":          code,
             "redirect_uri":  f"{app_base}/auth/github/callback",
         },
         headers={"Accept": "application/json"},
-        timeout=10,
     )
-    if not r.ok:
+    if not r.is_success:
         return HTMLResponse(f"<p>Token exchange failed: {r.status_code}</p>", status_code=502)
 
     token_data = r.json()
@@ -179,12 +261,11 @@ async def github_oauth_callback(request: Request, code: str = "", state: str = "
     next_url = request.session.pop("gh_oauth_next", "/repos/browse")
 
     # Fetch the authenticated user's login so we can use it for GHCR
-    user_r = http_requests.get(
+    user_r = await _gh_client.get(
         "https://api.github.com/user",
-        headers={"Accept": "application/vnd.github+json", "Authorization": f"Bearer {access_token}"},
-        timeout=10,
+        headers={"Authorization": f"Bearer {access_token}"},
     )
-    username = user_r.json().get("login", "") if user_r.ok else ""
+    username = user_r.json().get("login", "") if user_r.is_success else ""
     if username:
         request.session["github_username"] = username
         save_github_creds(username, access_token)
@@ -207,12 +288,12 @@ async def github_oauth_disconnect(request: Request):
 
 @app.get("/repos/browse", response_class=HTMLResponse)
 @require_login
-async def browse_repos(request: Request):
+async def browse_repos(request: Request, sess: SessionCtx = Depends(session_ctx)):
     """Show a GitHub repo browser. Requires OAuth token in session."""
-    gh_token     = request.session.get("github_token") or GITHUB_TOKEN
-    gh_connected = bool(request.session.get("github_token"))
+    gh_token     = sess.gh_token or GITHUB_TOKEN
+    gh_connected = bool(sess.gh_token)
     gh_oauth_ok  = bool(models.get_setting("GITHUB_CLIENT_ID", ""))
-    gh_username  = request.session.get("github_username", "")
+    gh_username  = sess.gh_username
     # Pass already-tracked repo names so the browser can mark them
     repos_set    = [r["github_repo"] for r in models.list_repos()]
     return templates.TemplateResponse("browse.html", {
@@ -225,77 +306,96 @@ async def browse_repos(request: Request):
     })
 
 
-@app.get("/api/github/repos")
+class _RepoSummary(BaseModel):
+    full_name:      str
+    description:    str
+    language:       str
+    private:        bool
+    updated_at:     str
+    container_name: str
+    image:          str
+
+
+# A response model lets FastAPI serialise straight to JSON bytes via pydantic-core
+@app.get("/api/github/repos", response_model=list[_RepoSummary])
 @require_login
 async def api_github_repos(
     request: Request,
     q:    str = "",
     page: int = 1,
+    sess: SessionCtx = Depends(session_ctx),
 ):
     """
     Return the authenticated user's repos via their OAuth session token only.
     Requires the user to have explicitly connected GitHub in this session.
     """
-    token = request.session.get("github_token", "")
+    token = sess.gh_token
     if not token:
         return JSONResponse({"error": "GitHub not connected. Click 'Connect GitHub' to continue."}, status_code=401)
 
-    headers = {
-        "Accept":        "application/vnd.github+json",
-        "Authorization": f"Bearer {token}",
-    }
-
-    # Fetch the authenticated user's container packages first so we can filter
-    pkg_names: set = set()
-    pkg_resp = http_requests.get(
-        "https://api.github.com/user/packages",
-        headers=headers,
-        params={"package_type": "container", "per_page": 100},
-        timeout=10,
-    )
-    if pkg_resp.ok:
-        pkg_names = {p["name"].lower() for p in pkg_resp.json()}
-
-    if q:
+    headers = {"Authorization": f"Bearer {token}"}
+    token_key = _token_key(token)
+
+    # Fetch the authenticated user's container packages first so we can filter.
+    # Cached per token: paging through repos would otherwise re-fetch it each time.
+    pkg_key = f"gh:pkgs:{token_key}"
+    pkg_names = _gh_cache_get(pkg_key)
+    if pkg_names is None:
+        pkg_names = set()
+        pkg_resp = await _gh_client.get(
+            "https://api.github.com/user/packages",
+            headers=headers,
+            params={"package_type": "container", "per_page": 100},
+        )
+        if pkg_resp.is_success:
+            pkg_names = {p["name"].lower() for p in pkg_resp.json()}
+            _gh_cache_put(pkg_key, pkg_names, 120)
+
+    # Debounced search in the browser re-fires the same query; reuse it briefly
+    items_key = f"gh:repos:{token_key}:{page}:{q}"
+    items = _gh_cache_get(items_key)
+    if items is None and q:
         # Search within repos the user is affiliated with that also have a package
         affiliated_q = f"{q} user:@me"
-        r = http_requests.get(
+        r = await _gh_client.get(
             "https://api.github.com/search/repositories",
             headers=headers,
             params={"q": affiliated_q, "per_page": 50, "page": page, "sort": "updated"},
-            timeout=10,
         )
-        if not r.ok:
+        if not r.is_success:
             return JSONResponse({"error": f"GitHub API error {r.status_code}"}, status_code=502)
         items = r.json().get("items", [])
-    else:
+        _gh_cache_put(items_key, items, 30)
+    elif items is None:
         # List the authenticated user's own repos
-        r = http_requests.get(
+        r = await _gh_client.get(
             "https://api.github.com/user/repos",
             headers=headers,
             params={"per_page": 100, "page": page, "sort": "updated", "affiliation": "owner,collaborator,organization_member"},
-            timeout=10,
         )
-        if not r.ok:
+        if not r.is_success:
             return JSONResponse({"error": f"GitHub API error {r.status_code}"}, status_code=502)
         items = r.json()
-
-    # Only show repos that have a matching container package on GHCR
-    if pkg_names:
-        items = [repo for repo in items if repo["name"].lower() in pkg_names]
-
-    return [
-        {
-            "full_name":       repo["full_name"],
+        _gh_cache_put(items_key, items, 30)
+
+    # Single pass: filter to repos with a matching GHCR package and shape the rows
+    out = []
+    for repo in items:
+        name = repo["name"].lower()
+        if pkg_names and name not in pkg_names:
+            continue
+        full_name = repo["full_name"]
+        out.append({
+            "full_name":       full_name,
             "description":     repo.get("description") or "",
             "language":        repo.get("language") or "",
             "private":         repo.get("private", False),
-            "updated_at":      repo.get("updated_at", "")[:10],
-            "container_name":  repo["name"].replace("-", "_").lower(),
-            "image":           f"ghcr.io/{repo['full_name'].split('/')[0].lower()}/{repo['name'].lower()}:latest",
-        }
-        for repo in items
-    ]
+            "updated_at":      (repo.get("updated_at") or "")[:10],
+            "container_name":  name.replace("-", "_"),
+            "image":           f"ghcr.io/{full_name.split('/')[0].lower()}/{name}:latest",
+        })
+    return out
+
 
 @app.get("/api/github/lookup")
 @require_login
@@ -312,37 +412,35 @@ async def github_lookup(request: Request, repo: str = ""):
 
     owner, repo_name = repo.split("/", 1)
     token = _get_effective_token(request)
-    headers = {"Accept": "application/vnd.github+json"}
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-
-    # Fetch repo metadata
-    r = http_requests.get(
-        f"https://api.github.com/repos/{owner}/{repo_name}",
-        headers=headers, timeout=10,
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    # The repo form calls this on every typing pause — reuse recent answers
+    cache_key = f"gh:lookup:{_token_key(token)}:{owner.lower()}/{repo_name.lower()}"
+    cached = _gh_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Repo metadata plus both package endpoints in parallel — latency is the
+    # slowest of the three rather than their sum
+    pkg_params = {"package_type": "container"}
+    r, user_pkgs, org_pkgs = await asyncio.gather(
+        _gh_client.get(f"https://api.github.com/repos/{owner}/{repo_name}", headers=headers),
+        _gh_client.get(f"https://api.github.com/users/{owner}/packages", headers=headers, params=pkg_params),
+        _gh_client.get(f"https://api.github.com/orgs/{owner}/packages", headers=headers, params=pkg_params),
     )
     if r.status_code == 404:
         return JSONResponse({"error": f"Repository '{repo}' not found"}, status_code=404)
-    if not r.ok:
+    if not r.is_success:
         return JSONResponse({"error": f"GitHub API error: {r.status_code}"}, status_code=502)
 
     meta = r.json()
 
-    # Fetch container packages — try user endpoint first, then org endpoint
+    # Container packages — prefer the user endpoint, then the org endpoint
     packages = []
     matched_image = f"ghcr.io/{owner.lower()}/{repo_name.lower()}:latest"  # sensible default
 
-    for pkg_url in [
-        f"https://api.github.com/users/{owner}/packages",
-        f"https://api.github.com/orgs/{owner}/packages",
-    ]:
-        pkg_resp = http_requests.get(
-            pkg_url,
-            headers=headers,
-            params={"package_type": "container"},
-            timeout=10,
-        )
-        if pkg_resp.ok:
+    for pkg_resp in (user_pkgs, org_pkgs):
+        if pkg_resp.is_success:
             for pkg in pkg_resp.json():
                 pkg_name = pkg.get("name", "")
                 entry = f"ghcr.io/{owner.lower()}/{pkg_name.lower()}:latest"
@@ -355,7 +453,7 @@ async def github_lookup(request: Request, repo: str = ""):
     # Derive a safe container name: replace - with _
     container_name = repo_name.replace("-", "_").replace("/", "_").lower()
 
-    return {
+    result = {
         "owner":          owner,
         "repo_name":      repo_name,
         "image":          matched_image,
@@ -364,32 +462,70 @@ async def github_lookup(request: Request, repo: str = ""):
         "default_branch": meta.get("default_branch", "main"),
         "packages":       packages,
     }
+    _gh_cache_put(cache_key, result, 60)
+    return result
 
 
 # ────────────────────────────────────────────────────────────────────────────
 # Dashboard
 # ────────────────────────────────────────────────────────────────────────────
 
+# Fixed key set for the dashboard context; copied and filled per request
+_DASH_CTX_TEMPLATE = {
+    "request":      None,
+    "repos":        None,
+    "gh_connected": False,
+    "gh_username":  "",
+    "gh_oauth_ok":  False,
+    "webhook_url":  "",
+}
+
+
 @app.get("/", response_class=HTMLResponse)
 @require_login
-async def dashboard(request: Request):
+async def dashboard(request: Request, sess: SessionCtx = Depends(session_ctx)):
     repos        = models.list_repos()
-    gh_connected = bool(request.session.get("github_token"))
-    gh_username  = request.session.get("github_username", "")
-    gh_oauth_ok  = bool(models.get_setting("GITHUB_CLIENT_ID", ""))
-    ui           = models.get_ui_context()
-    base_url     = models.get_setting("APP_BASE_URL", "").rstrip("/")
+    gh_connected = bool(sess.gh_token)
+    gh_username  = sess.gh_username
+    settings     = models.load_app_settings()
+    gh_oauth_ok  = bool(models.get_setting("GITHUB_CLIENT_ID", "", settings))
+    # The template global is already current; no need to rebuild the UI context
+    ui           = templates.env.globals["ui"]
+    base_url     = models.get_setting("APP_BASE_URL", "", settings).rstrip("/")
     if not base_url:
         base_url = str(request.base_url).rstrip("/")
     webhook_url  = base_url + ui["webhook_path"]
-    return templates.TemplateResponse("dashboard.html", {
-        "request":      request,
-        "repos":        repos,
-        "gh_connected": gh_connected,
-        "gh_username":  gh_username,
-        "gh_oauth_ok":  gh_oauth_ok,
-        "webhook_url":  webhook_url,
-    })
+    ctx = _DASH_CTX_TEMPLATE.copy()
+    ctx.update(
+        request=request,
+        repos=repos,
+        gh_connected=gh_connected,
+        gh_username=gh_username,
+        gh_oauth_ok=gh_oauth_ok,
+        webhook_url=webhook_url,
+    )
+    return templates.TemplateResponse("dashboard.html", ctx)
+
+
+class _TrackedRepo(BaseModel):
+    id:             str
+    github_repo:    str
+    container_name: str
+    image:          str
+    branch:         Optional[str]
+    ports:          Optional[str]
+    has_env:        bool
+    last_deployed:  Optional[str]
+
+
+@app.get("/api/repos", response_model=list[_TrackedRepo])
+@require_login
+async def api_repos(request: Request):
+    """The dashboard's repo list as JSON, for scripts and polling views.
+
+    Only the fields the dashboard shows — volumes, flags and env stay out.
+    """
+    return models.list_repos()
 
 
 # ────────────────────────────────────────────────────────────────────────────
@@ -408,7 +544,7 @@ async def new_repo_form(request: Request):
 
 @app.post("/repos/new", response_class=HTMLResponse)
 @require_login
-async def new_repo_submit(
+def new_repo_submit(
     request:        Request,
     github_repo:    str = Form(...),
     container_name: str = Form(...),
@@ -457,7 +593,7 @@ async def edit_repo_form(request: Request, repo_id: str):
 
 @app.post("/repos/{repo_id}/edit", response_class=HTMLResponse)
 @require_login
-async def edit_repo_submit(
+def edit_repo_submit(
     request:        Request,
     repo_id:        str,
     github_repo:    str = Form(...),
@@ -501,7 +637,7 @@ async def edit_repo_submit(
 
 @app.post("/repos/{repo_id}/delete")
 @require_login
-async def delete_repo(request: Request, repo_id: str):
+def delete_repo(request: Request, repo_id: str):
     models.delete_repo(repo_id)
     return RedirectResponse("/", status_code=302)
 
@@ -519,13 +655,13 @@ async def manual_deploy(request: Request, repo_id: str):
     if repo is None:
         return RedirectResponse("/", status_code=302)
 
-    def _run():
+    async def _run():
         try:
-            deploy(repo)
+            await deploy(repo)
         except Exception as e:
-            notify_deploy_fail(repo["github_repo"], repo.get("container_name", "?"), str(e))
+            notify_deploy_fail(repo["github_repo"], repo.get("container_name", "?"), str(e)[-900:])
 
-    asyncio.create_task(asyncio.to_thread(_run))
+    asyncio.create_task(_run())
     return RedirectResponse(f"/repos/{repo_id}/logs", status_code=302)
 
 
@@ -536,7 +672,7 @@ async def manual_restart(request: Request, repo_id: str):
     repo = models.get_repo(repo_id)
     if repo is None:
         return RedirectResponse("/", status_code=302)
-    subprocess.run(["docker", "restart", repo["container_name"]], capture_output=True)
+    await run_docker("restart", repo["container_name"])
     return RedirectResponse("/", status_code=302)
 
 
@@ -548,8 +684,8 @@ async def manual_stop(request: Request, repo_id: str):
     if repo is None:
         return RedirectResponse("/", status_code=302)
     container = repo["container_name"]
-    subprocess.run(["docker", "stop", container], capture_output=True)
-    subprocess.run(["docker", "rm", "-f", container], capture_output=True)
+    await run_docker("stop", container)
+    await run_docker("rm", "-f", container)
     return RedirectResponse("/", status_code=302)
 
 
@@ -575,11 +711,14 @@ async def api_repo_logs(request: Request, repo_id: str, tail: int = 300):
 
     container = repo["container_name"]
     try:
-        r = subprocess.run(
-            ["docker", "logs", "--timestamps", "--tail", str(tail), container],
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=10,
+        # Fetch logs and running state concurrently
+        r, state = await asyncio.gather(
+            # stderr merged into stdout at OS level so timestamps are in order
+            run_docker("logs", "--timestamps", "--tail", str(tail), container,
+                       merge_stderr=True, timeout=10),
+            run_docker("container", "inspect", "--format", "{{.State.Running}}", container,
+                       timeout=10),
         )
-        # stderr merged into stdout at OS level so timestamps are in order
         lines = r.stdout.splitlines()
         # Detect if container exists at all
         if r.returncode != 0 and not lines:
@@ -588,14 +727,9 @@ async def api_repo_logs(request: Request, repo_id: str, tail: int = 300):
                 "running":   False,
                 "lines":     [f"[no output — container '{container}' may not exist yet]"],
             })
-        # Check running state
-        ps = subprocess.run(
-            ["docker", "ps", "--filter", f"name=^{container}$", "--format", "{{.Names}}"],
-            capture_output=True, text=True,
-        )
-        running = container in ps.stdout
+        running = state.returncode == 0 and state.stdout.strip() == "true"
         return JSONResponse({"container": container, "running": running, "lines": lines})
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         return JSONResponse({"error": "docker logs timed out"}, status_code=504)
     except FileNotFoundError:
         return JSONResponse({"error": "docker not found on this host"}, status_code=500)
@@ -608,46 +742,62 @@ async def api_repo_logs(request: Request, repo_id: str, tail: int = 300):
 @app.get("/system/logs", response_class=HTMLResponse)
 @require_login
 async def system_logs_page(request: Request):
-    return templates.TemplateResponse("system_logs.html", {"request": request})
+    return templates.TemplateResponse("system_logs.html", {
+        "request": request, "max_lines": _log_buffer.MAX_LINES,
+    })
 
 
 @app.get("/api/system/logs")
 @require_login
-async def api_system_logs(request: Request):
-    return JSONResponse({"lines": _log_buffer.get_lines()})
+async def api_system_logs(request: Request, since: Optional[int] = None):
+    """Log lines; pass back the returned `gen` as `since` to get only new ones."""
+    lines, gen, reset = _log_buffer.get_lines(since)
+    return JSONResponse({"lines": lines, "gen": gen, "reset": reset})
 
 
 # ────────────────────────────────────────────────────────────────────────────
 # Settings
 # ────────────────────────────────────────────────────────────────────────────
 
+# UI-editable settings and whether the settings page masks their value
+_SETTINGS_FIELDS: tuple[tuple[str, bool], ...] = (
+    ("GHCR_USERNAME",         False),
+    ("GHCR_PAT",              True),
+    ("GITHUB_WEBHOOK_SECRET", True),
+    ("GITHUB_CLIENT_ID",      False),
+    ("GITHUB_CLIENT_SECRET",  True),
+    ("APP_BASE_URL",          False),
+    ("DISCORD_WEBHOOK_URL",   True),
+)
+_ALLOWED_SETTINGS = frozenset(key for key, _ in _SETTINGS_FIELDS)
+
+
+_BULLETS = "●" * 24
+
+
 def _mask(value: str) -> str:
     """Return a redacted version: first 4 chars visible, rest replaced with bullets."""
     if not value:
         return ""
-    visible = value[:4]
-    return visible + "●" * min(len(value) - 4, 24)
+    return value[:4] + _BULLETS[:max(len(value) - 4, 0)]
 
 
 @app.get("/settings", response_class=HTMLResponse)
 @require_login
-async def settings_page(request: Request, error: str = "", success: str = "", tab: str = "credentials"):
-    creds = {
-        "GHCR_USERNAME":          models.get_setting("GHCR_USERNAME", ""),
-        "GHCR_PAT":               _mask(models.get_setting("GHCR_PAT", "")),
-        "GITHUB_WEBHOOK_SECRET":  _mask(models.get_setting("GITHUB_WEBHOOK_SECRET", "")),
-        "GITHUB_CLIENT_ID":       models.get_setting("GITHUB_CLIENT_ID", ""),
-        "GITHUB_CLIENT_SECRET":   _mask(models.get_setting("GITHUB_CLIENT_SECRET", "")),
-        "APP_BASE_URL":           models.get_setting("APP_BASE_URL", ""),
-        "DISCORD_WEBHOOK_URL":    _mask(models.get_setting("DISCORD_WEBHOOK_URL", "")),
-    }
-    overridden = set(models.load_app_settings().keys())
+async def settings_page(request: Request, error: str = "", success: str = "", tab: str = "credentials",
+                        sess: SessionCtx = Depends(session_ctx)):
+    settings = models.load_app_settings()
+    creds = {}
+    for key, masked in _SETTINGS_FIELDS:
+        value = models.get_setting(key, "", settings)
+        creds[key] = _mask(value) if masked else value
+    overridden = set(settings.keys())
     return templates.TemplateResponse("settings.html", {
         "request":      request,
         "creds":        creds,
         "overridden":   overridden,
         "users":        models.list_users(),
-        "current_user": request.session.get("username", ""),
+        "current_user": sess.username,
         "active_tab":   tab,
         "error":        error,
         "success":      success,
@@ -656,26 +806,23 @@ async def settings_page(request: Request, error: str = "", success: str = "", ta
 
 @app.post("/settings/update", response_class=HTMLResponse)
 @require_login
-async def settings_update(
+def settings_update(
     request: Request,
     key:     str = Form(...),
     value:   str = Form(""),
 ):
-    allowed = {
-        "GHCR_USERNAME", "GHCR_PAT", "GITHUB_WEBHOOK_SECRET",
-        "GITHUB_CLIENT_ID", "GITHUB_CLIENT_SECRET",
-        "APP_BASE_URL", "DISCORD_WEBHOOK_URL",
-    }
-    if key not in allowed:
+    if key not in _ALLOWED_SETTINGS:
         return RedirectResponse(f"/settings?tab=credentials&error=Unknown+setting+key.", status_code=302)
     models.save_app_setting(key, value)
+    if key == "DISCORD_WEBHOOK_URL":
+        forget_webhook_url()
     msg = f"{key}+cleared." if not value.strip() else f"{key}+saved."
     return RedirectResponse(f"/settings?tab=credentials&success={msg}", status_code=302)
 
 
 @app.post("/settings/users/add", response_class=HTMLResponse)
 @require_login
-async def settings_add_user(
+def settings_add_user(
     request:  Request,
     username: str = Form(...),
     password: str = Form(...),
@@ -688,8 +835,8 @@ async def settings_add_user(
 
 @app.post("/settings/users/{target}/delete", response_class=HTMLResponse)
 @require_login
-async def settings_delete_user(request: Request, target: str):
-    current = request.session.get("username", "")
+def settings_delete_user(request: Request, target: str, sess: SessionCtx = Depends(session_ctx)):
+    current = sess.username
     if target == "admin":
         return RedirectResponse("/settings?tab=users&error=The+admin+account+cannot+be+deleted.", status_code=302)
     if target == current:
@@ -702,13 +849,14 @@ async def settings_delete_user(request: Request, target: str):
 
 @app.post("/settings/users/{target}/password", response_class=HTMLResponse)
 @require_login
-async def settings_change_password(
+def settings_change_password(
     request:      Request,
     target:       str,
     new_password: str = Form(...),
     confirm:      str = Form(...),
+    sess:         SessionCtx = Depends(session_ctx),
 ):
-    current = request.session.get("username", "")
+    current = sess.username
     # Only allow changing your own password, unless you are admin
     if target != current and current != "admin":
         return RedirectResponse("/settings?tab=users&error=You+can+only+change+your+own+password.", status_code=302)
@@ -722,7 +870,7 @@ async def settings_change_password(
 
 @app.post("/settings/customize", response_class=HTMLResponse)
 @require_login
-async def settings_customize(
+def settings_customize(
     request:       Request,
     accent_color:  str = Form(""),
     surface_color: str = Form(""),
@@ -748,5 +896,6 @@ async def github_webhook(
 ):
     body = await request.body()
     verify_signature(x_hub_signature_256, body)
-    await handle_payload(body)
+    # Deploys run on the background worker so GitHub gets its 200 right away
+    await enqueue_payload(body)
     return {"status": "ok"}
@@ -5,15 +5,21 @@ Plain .env content is stored in /etc/deployhook/.secrets/{repo_id}.env
 """
 from __future__ import annotations
 
+import fcntl
+import functools
 import hashlib
 import hmac as _hmac
 import json
 import os
+import queue
 import secrets
+import shlex
 import sqlite3
+import tempfile
+import threading
+import time
 import uuid
 from contextlib import contextmanager
-from datetime import datetime, timezone
 from typing import Optional
 
 # ---------------------------------------------------------------------------
@@ -33,21 +39,101 @@ _OLD_SECRETS = os.path.join(os.path.dirname(__file__), "..", "secrets")
 # Database bootstrap + helpers
 # ---------------------------------------------------------------------------
 
+# Set once the data dirs exist; _db() and _env_path() then skip the makedirs calls
+_dirs_ready = False
+
+
 def _ensure_dirs():
+    global _dirs_ready
+    if _dirs_ready:
+        return
     os.makedirs(DB_DIR, exist_ok=True)
     os.makedirs(SECRETS_PATH, exist_ok=True)
+    _dirs_ready = True
+
+
+# journal_mode is stored in the DB file, so switching to WAL once per process is enough
+_wal_enabled = False
+
+# Per-connection tuning. synchronous=NORMAL is durable under WAL except on power
+# loss, where at most the last commits roll back. busy_timeout comes from
+# sqlite3.connect()'s default 5 s timeout.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+# Idle connections kept open for reuse. Borrowing never blocks: when every pooled
+# connection is in use (or _db() is nested) a fresh one is opened, and closed on
+# return if the pool is already full. sqlite3's prepared-statement cache lives on
+# the connection, so pooled connections also keep the hot queries compiled.
+_POOL_SIZE = 8
+_STATEMENT_CACHE = 256
+_pool: queue.Queue = queue.Queue(maxsize=_POOL_SIZE)
+
+
+def _connect() -> sqlite3.Connection:
+    global _wal_enabled
+    # Pooled connections move between the event loop and threadpool threads,
+    # but only ever one borrower at a time
+    con = sqlite3.connect(DB_PATH, check_same_thread=False,
+                          cached_statements=_STATEMENT_CACHE)
+    con.row_factory = sqlite3.Row
+    if not _wal_enabled:
+        # WAL: one sequential append per commit, and readers don't block the writer
+        con.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled = True
+    for pragma in _CONNECTION_PRAGMAS:
+        con.execute(pragma)
+    return con
+
+
+def _borrow() -> sqlite3.Connection:
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _give_back(con: sqlite3.Connection):
+    try:
+        _pool.put_nowait(con)
+    except queue.Full:
+        con.close()
 
 
 @contextmanager
 def _db():
     _ensure_dirs()
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
+    con = _borrow()
     try:
         yield con
         con.commit()
-    finally:
-        con.close()
+    except BaseException:
+        try:
+            con.rollback()
+        except sqlite3.Error:
+            con.close()   # unusable — don't hand it to the next caller
+            raise
+        _give_back(con)
+        raise
+    _give_back(con)
+
+
+def close_db():
+    """Close pooled connections (app shutdown); the last close checkpoints the WAL."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+# PRAGMA user_version once the legacy JSON import has run, so later starts skip it
+_LEGACY_IMPORTED = 1
 
 
 def _init_db():
@@ -64,7 +150,8 @@ def _init_db():
                 extra_flags    TEXT DEFAULT '[]',
                 branch         TEXT DEFAULT '',
                 created_at     TEXT,
-                last_deployed  TEXT
+                last_deployed  TEXT,
+                extra_flags_tokens TEXT
             );
             CREATE TABLE IF NOT EXISTS github_creds (
                 key   TEXT PRIMARY KEY,
@@ -83,12 +170,44 @@ def _init_db():
                 key   TEXT PRIMARY KEY,
                 value TEXT
             );
+            CREATE TABLE IF NOT EXISTS events (
+                id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                received_at  TEXT,
+                body         BLOB,
+                status       TEXT DEFAULT 'pending',
+                attempts     INTEGER DEFAULT 0,
+                next_attempt REAL DEFAULT 0,
+                last_error   TEXT DEFAULT '',
+                failed_repos TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_due ON events(status, next_attempt);
+            CREATE INDEX IF NOT EXISTS idx_repos_github_repo ON repos(github_repo);
+            CREATE TABLE IF NOT EXISTS sessions (
+                id      TEXT PRIMARY KEY,
+                data    TEXT,
+                expires REAL
+            );
         """)
+        # Column added after release; NULL marks rows saved before flags were pre-tokenized
+        cols = {r["name"] for r in con.execute("PRAGMA table_info(repos)")}
+        if "extra_flags_tokens" not in cols:
+            con.execute("ALTER TABLE repos ADD COLUMN extra_flags_tokens TEXT")
+        # NULL means "deploy every matching repo"; set after a partial fan-out failure
+        cols = {r["name"] for r in con.execute("PRAGMA table_info(events)")}
+        if "failed_repos" not in cols:
+            con.execute("ALTER TABLE events ADD COLUMN failed_repos TEXT")
+        migrated = con.execute("PRAGMA user_version").fetchone()[0] >= _LEGACY_IMPORTED
+    if migrated:
+        return
     _migrate_json()
+    with _db() as con:
+        con.execute(f"PRAGMA user_version={_LEGACY_IMPORTED}")
+    _forget_settings()   # the migration may have imported settings / UI config
 
 
 def _migrate_json():
-    """One-time import of legacy JSON files into the SQLite DB. No-ops if data exists."""
+    """One-time import of legacy JSON files into the SQLite DB (gated by _init_db).
+    Rows that already exist are left alone."""
     with _db() as con:
         # --- repos.json ---
         repos_json = os.path.join(_OLD_DATA, "repos.json")
@@ -96,24 +215,26 @@ def _migrate_json():
             try:
                 with open(repos_json) as f:
                     repos = json.load(f)
-                for rid, r in repos.items():
-                    exists = con.execute("SELECT 1 FROM repos WHERE id=?", (rid,)).fetchone()
-                    if not exists:
-                        con.execute(
-                            "INSERT INTO repos VALUES (?,?,?,?,?,?,?,?,?,?)",
-                            (
-                                rid,
-                                r.get("github_repo", ""),
-                                r.get("container_name", ""),
-                                r.get("image", ""),
-                                r.get("ports", ""),
-                                json.dumps(r.get("volumes", [])),
-                                json.dumps(r.get("extra_flags", [])),
-                                r.get("branch", ""),
-                                r.get("created_at", ""),
-                                r.get("last_deployed"),
-                            ),
+                # OR IGNORE on the primary key keeps rows that are already imported
+                con.executemany(
+                    "INSERT OR IGNORE INTO repos (id, github_repo, container_name, image, ports, volumes, "
+                    "extra_flags, branch, created_at, last_deployed) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                    [
+                        (
+                            rid,
+                            r.get("github_repo", ""),
+                            r.get("container_name", ""),
+                            r.get("image", ""),
+                            r.get("ports", ""),
+                            json.dumps(r.get("volumes", [])),
+                            json.dumps(r.get("extra_flags", [])),
+                            r.get("branch", ""),
+                            r.get("created_at", ""),
+                            r.get("last_deployed"),
                         )
+                        for rid, r in repos.items()
+                    ],
+                )
             except Exception:
                 pass
 
@@ -123,10 +244,7 @@ def _migrate_json():
             try:
                 with open(creds_json) as f:
                     creds = json.load(f)
-                for k, v in creds.items():
-                    exists = con.execute("SELECT 1 FROM github_creds WHERE key=?", (k,)).fetchone()
-                    if not exists:
-                        con.execute("INSERT INTO github_creds VALUES (?,?)", (k, v))
+                con.executemany("INSERT OR IGNORE INTO github_creds VALUES (?,?)", creds.items())
             except Exception:
                 pass
 
@@ -136,13 +254,10 @@ def _migrate_json():
             try:
                 with open(users_json) as f:
                     users = json.load(f)
-                for uname, u in users.items():
-                    exists = con.execute("SELECT 1 FROM users WHERE username=?", (uname,)).fetchone()
-                    if not exists:
-                        con.execute(
-                            "INSERT INTO users VALUES (?,?,?)",
-                            (uname, u.get("hash", ""), u.get("salt", "")),
-                        )
+                con.executemany(
+                    "INSERT OR IGNORE INTO users VALUES (?,?,?)",
+                    [(uname, u.get("hash", ""), u.get("salt", "")) for uname, u in users.items()],
+                )
             except Exception:
                 pass
 
@@ -152,10 +267,10 @@ def _migrate_json():
             try:
                 with open(settings_json) as f:
                     settings = json.load(f)
-                for k, v in settings.items():
-                    exists = con.execute("SELECT 1 FROM app_settings WHERE key=?", (k,)).fetchone()
-                    if not exists:
-                        con.execute("INSERT INTO app_settings VALUES (?,?)", (k, str(v)))
+                con.executemany(
+                    "INSERT OR IGNORE INTO app_settings VALUES (?,?)",
+                    [(k, str(v)) for k, v in settings.items()],
+                )
             except Exception:
                 pass
 
@@ -165,10 +280,10 @@ def _migrate_json():
             try:
                 with open(ui_json) as f:
                     ui = json.load(f)
-                for k, v in ui.items():
-                    exists = con.execute("SELECT 1 FROM ui_config WHERE key=?", (k,)).fetchone()
-                    if not exists:
-                        con.execute("INSERT INTO ui_config VALUES (?,?)", (k, str(v)))
+                con.executemany(
+                    "INSERT OR IGNORE INTO ui_config VALUES (?,?)",
+                    [(k, str(v)) for k, v in ui.items()],
+                )
             except Exception:
                 pass
 
@@ -196,18 +311,62 @@ def _env_path(repo_id: str) -> str:
 # Public API — Repos
 # ---------------------------------------------------------------------------
 
-def _row_to_repo(row) -> dict:
+def _utc_iso(ts: Optional[float] = None) -> str:
+    """ISO-8601 UTC timestamp to the second, e.g. 2024-01-31T12:00:00+00:00.
+    Same shape as datetime.isoformat() minus the microseconds, without building a datetime."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+
+
+def _env_ids() -> set[str]:
+    """Repo ids that have a .env file — one directory read instead of a stat per repo."""
+    _ensure_dirs()
+    with os.scandir(SECRETS_PATH) as it:
+        return {e.name[:-4] for e in it if e.name.endswith(".env")}
+
+
+_decode_json = json.JSONDecoder().decode
+
+
+def _json_list(raw: Optional[str]) -> list:
+    """Decode a JSON list column; most rows hold "[]", which skips the decoder.
+    Always returns a fresh list so callers may mutate it."""
+    if not raw or raw == "[]":
+        return []
+    return _decode_json(raw)
+
+
+def _json_list_text(items: list) -> str:
+    """Inverse of _json_list(); the usual empty list never reaches the encoder."""
+    return json.dumps(items) if items else "[]"
+
+
+def _form_lines(text: str) -> list[str]:
+    """Non-blank, stripped lines of a multi-line form field."""
+    if not text:
+        return []
+    return [line for line in map(str.strip, text.splitlines()) if line]
+
+
+def _row_to_repo(row, env_ids: Optional[set[str]] = None) -> dict:
     d = dict(row)
-    d["volumes"]     = json.loads(d.get("volumes", "[]"))
-    d["extra_flags"] = json.loads(d.get("extra_flags", "[]"))
-    d["has_env"]     = os.path.exists(_env_path(d["id"]))
+    d["volumes"]     = _json_list(d.get("volumes"))
+    d["extra_flags"] = _json_list(d.get("extra_flags"))
+    tokens = d.get("extra_flags_tokens")
+    d["extra_flags_tokens"] = _json_list(tokens) if tokens is not None else None
+    if env_ids is None:
+        d["has_env"] = os.path.exists(_env_path(d["id"]))
+    else:
+        d["has_env"] = d["id"] in env_ids
     return d
 
 
 def list_repos() -> list[dict]:
     with _db() as con:
         rows = con.execute("SELECT * FROM repos").fetchall()
-    return [_row_to_repo(r) for r in rows]
+    if not rows:
+        return []
+    env_ids = _env_ids()
+    return [_row_to_repo(r, env_ids) for r in rows]
 
 
 def get_repo(repo_id: str) -> Optional[dict]:
@@ -216,10 +375,12 @@ def get_repo(repo_id: str) -> Optional[dict]:
     return _row_to_repo(row) if row else None
 
 
-def get_repo_by_full_name(full_name: str) -> Optional[dict]:
+def list_repos_by_full_name(full_name: str) -> list[dict]:
+    """Return every repo entry tracking the given GitHub repo (one webhook can fan out)."""
     with _db() as con:
-        row = con.execute("SELECT * FROM repos WHERE github_repo=?", (full_name,)).fetchone()
-    return _row_to_repo(row) if row else None
+        rows = con.execute("SELECT * FROM repos WHERE github_repo=?", (full_name,)).fetchall()
+    env_ids = _env_ids() if len(rows) > 1 else None
+    return [_row_to_repo(r, env_ids) for r in rows]
 
 
 def save_repo(
@@ -234,23 +395,29 @@ def save_repo(
     env_content:    str = "",
     branch:         str = "",
 ) -> str:
-    now = datetime.now(timezone.utc).isoformat()
-    vols  = json.dumps([v.strip() for v in volumes.splitlines()    if v.strip()])
-    flags = json.dumps([f.strip() for f in extra_flags.splitlines() if f.strip()])
+    now = _utc_iso()
+    vols  = _json_list_text(_form_lines(volumes))
+    flag_lines = _form_lines(extra_flags)
+    flags = _json_list_text(flag_lines)
+    # Tokenize once here so deploys don't re-run shlex, and bad quoting fails on save
+    tokens = []
+    for line in flag_lines:
+        try:
+            tokens += shlex.split(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid extra flag line {line!r}: {e}") from None
+    flag_tokens = _json_list_text(tokens)
 
     if repo_id is None:
-        repo_id    = str(uuid.uuid4())
-        created_at = now
-        last_dep   = None
-    else:
-        with _db() as con:
-            existing = con.execute("SELECT created_at, last_deployed FROM repos WHERE id=?", (repo_id,)).fetchone()
-        created_at = existing["created_at"] if existing else now
-        last_dep   = existing["last_deployed"] if existing else None
+        repo_id = str(uuid.uuid4())
 
+    # One upsert: created_at / last_deployed are only set for a new row, and an
+    # update leaves them alone — no read of the existing row needed
     with _db() as con:
         con.execute(
-            """INSERT INTO repos VALUES (?,?,?,?,?,?,?,?,?,?)
+            """INSERT INTO repos (id, github_repo, container_name, image, ports, volumes,
+                                  extra_flags, branch, created_at, last_deployed, extra_flags_tokens)
+               VALUES (?,?,?,?,?,?,?,?,?,NULL,?)
                ON CONFLICT(id) DO UPDATE SET
                    github_repo=excluded.github_repo,
                    container_name=excluded.container_name,
@@ -259,24 +426,48 @@ def save_repo(
                    volumes=excluded.volumes,
                    extra_flags=excluded.extra_flags,
                    branch=excluded.branch,
-                   created_at=excluded.created_at,
-                   last_deployed=excluded.last_deployed""",
-            (repo_id, github_repo, container_name, image, ports, vols, flags, branch.strip(), created_at, last_dep),
+                   extra_flags_tokens=excluded.extra_flags_tokens""",
+            (repo_id, github_repo, container_name, image, ports, vols, flags, branch.strip(), now, flag_tokens),
         )
 
     if env_content.strip():
-        with open(_env_path(repo_id), "w") as f:
-            f.write(env_content.strip())
+        _write_env(repo_id, env_content.strip())
 
     return repo_id
 
 
+def _write_env(repo_id: str, content: str):
+    """Replace a repo's .env atomically; a save that didn't change it writes nothing."""
+    ep = _env_path(repo_id)
+    # newline="" on both sides: form text arrives with CRLF, and a translating
+    # read would never compare equal to it
+    try:
+        with open(ep, newline="") as f:
+            if f.read() == content:
+                return
+    except FileNotFoundError:
+        pass
+    # Unique temp name: two concurrent saves of one repo must not share a file
+    fd, tmp = tempfile.mkstemp(dir=SECRETS_PATH, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            f.write(content)
+        os.replace(tmp, ep)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 def delete_repo(repo_id: str):
     with _db() as con:
         con.execute("DELETE FROM repos WHERE id=?", (repo_id,))
-    ep = _env_path(repo_id)
-    if os.path.exists(ep):
-        os.remove(ep)
+    try:
+        os.remove(_env_path(repo_id))
+    except FileNotFoundError:
+        pass
 
 
 def read_env_content(repo_id: str) -> Optional[str]:
@@ -291,18 +482,134 @@ def touch_last_deployed(repo_id: str):
     with _db() as con:
         con.execute(
             "UPDATE repos SET last_deployed=? WHERE id=?",
-            (datetime.now(timezone.utc).isoformat(), repo_id),
+            (_utc_iso(), repo_id),
         )
 
 
+# ---------------------------------------------------------------------------
+# Webhook event queue — verified payloads waiting for the deploy worker
+# ---------------------------------------------------------------------------
+
+def enqueue_event(body: bytes) -> int:
+    with _db() as con:
+        cur = con.execute(
+            "INSERT INTO events (received_at, body) VALUES (?,?)",
+            (_utc_iso(), body),
+        )
+    return cur.lastrowid
+
+
+def claim_events(limit: int) -> list[dict]:
+    """Mark up to `limit` due pending events as running and return them, oldest first.
+
+    failed_repos is the set of repo ids left to retry, or None for the whole fan-out.
+    """
+    with _db() as con:
+        rows = con.execute(
+            "SELECT id, body, attempts, failed_repos FROM events "
+            "WHERE status='pending' AND next_attempt<=? ORDER BY id LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+        con.executemany("UPDATE events SET status='running' WHERE id=?", [(r["id"],) for r in rows])
+    events = []
+    for r in rows:
+        e = dict(r)
+        failed = e["failed_repos"]
+        e["failed_repos"] = set(_json_list(failed)) if failed is not None else None
+        events.append(e)
+    return events
+
+
+def finish_event(event_id: int):
+    with _db() as con:
+        con.execute("UPDATE events SET status='done' WHERE id=?", (event_id,))
+
+
+def fail_event(
+    event_id: int,
+    attempts: int,
+    error: str,
+    retry_in: Optional[float],
+    failed_repos: Optional[list[str]] = None,
+):
+    """Record a failed attempt. retry_in=None gives up; otherwise re-queue after that many seconds.
+
+    failed_repos narrows the retry to those repo ids; None keeps what the event had.
+    """
+    with _db() as con:
+        if failed_repos is not None:
+            con.execute(
+                "UPDATE events SET failed_repos=? WHERE id=?",
+                (_json_list_text(failed_repos), event_id),
+            )
+        if retry_in is None:
+            con.execute(
+                "UPDATE events SET status='failed', attempts=?, last_error=? WHERE id=?",
+                (attempts, error, event_id),
+            )
+        else:
+            con.execute(
+                "UPDATE events SET status='pending', attempts=?, last_error=?, next_attempt=? WHERE id=?",
+                (attempts, error, time.time() + retry_in, event_id),
+            )
+
+
+def requeue_running_events() -> int:
+    """Put events left 'running' by a crash or restart back in the queue."""
+    with _db() as con:
+        cur = con.execute("UPDATE events SET status='pending' WHERE status='running'")
+    return cur.rowcount
+
+
+def purge_events(max_age_days: int = 7):
+    """Drop finished events older than max_age_days so the table stays small."""
+    cutoff = _utc_iso(time.time() - max_age_days * 86400)
+    with _db() as con:
+        con.execute("DELETE FROM events WHERE status IN ('done','failed') AND received_at<?", (cutoff,))
+
+
+# ---------------------------------------------------------------------------
+# Web UI sessions (see app/sessions.py)
+# ---------------------------------------------------------------------------
+
+def load_session(sid: str) -> Optional[tuple[dict, float]]:
+    """Return (data, expires) for a live session, or None if missing/expired."""
+    with _db() as con:
+        row = con.execute(
+            "SELECT data, expires FROM sessions WHERE id=? AND expires>?", (sid, time.time()),
+        ).fetchone()
+    return (json.loads(row["data"]), row["expires"]) if row else None
+
+
+def save_session(sid: str, data: dict, expires: float):
+    with _db() as con:
+        con.execute(
+            "INSERT INTO sessions VALUES (?,?,?) ON CONFLICT(id) DO UPDATE SET "
+            "data=excluded.data, expires=excluded.expires",
+            (sid, json.dumps(data), expires),
+        )
+
+
+def delete_session(sid: str):
+    with _db() as con:
+        con.execute("DELETE FROM sessions WHERE id=?", (sid,))
+
+
+def purge_sessions():
+    with _db() as con:
+        con.execute("DELETE FROM sessions WHERE expires<=?", (time.time(),))
+
+
 # ---------------------------------------------------------------------------
 # GitHub OAuth credentials
 # ---------------------------------------------------------------------------
 
 def save_github_creds(username: str, token: str):
     with _db() as con:
-        con.execute("INSERT INTO github_creds VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", ("username", username))
-        con.execute("INSERT INTO github_creds VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", ("token", token))
+        con.executemany(
+            "INSERT INTO github_creds VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (("username", username), ("token", token)),
+        )
 
 
 def load_github_creds() -> dict:
@@ -320,12 +627,62 @@ def clear_github_creds():
 # App settings (UI-editable overrides for env vars)
 # ---------------------------------------------------------------------------
 
-def load_app_settings() -> dict:
+class _TableMemo:
+    """Memoised read of a small table, reset by the code that writes it.
+
+    Readers and writers run on threadpool threads, so a reset can land while a
+    fill is still reading the old rows. The generation counter makes that fill
+    drop its result instead of caching stale data. The lock only covers the
+    compare-and-store, never the DB read.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._value = None
+        self._gen = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        value = self._value
+        if value is None:
+            gen = self._gen
+            value = self._load()
+            with self._lock:
+                if gen == self._gen:
+                    self._value = value
+        return value
+
+    def forget(self):
+        """Drop the cached value; call after the write has committed."""
+        with self._lock:
+            self._gen += 1
+            self._value = None
+
+
+def _read_app_settings() -> dict:
     with _db() as con:
         rows = con.execute("SELECT key, value FROM app_settings").fetchall()
     return {r["key"]: r["value"] for r in rows}
 
 
+# Only save_app_setting / save_ui_config write these tables, and they reset the memo
+_settings_memo = _TableMemo(_read_app_settings)
+
+
+def _app_settings() -> dict:
+    """Cached app_settings rows — read-only; callers that keep the dict get a copy."""
+    return _settings_memo.get()
+
+
+def _forget_settings():
+    _settings_memo.forget()
+    _ui_memo.forget()
+
+
+def load_app_settings() -> dict:
+    return dict(_app_settings())
+
+
 def save_app_setting(key: str, value: str):
     """Save or clear a single setting. Empty value removes the override."""
     if value.strip():
@@ -334,11 +691,16 @@ def save_app_setting(key: str, value: str):
     else:
         with _db() as con:
             con.execute("DELETE FROM app_settings WHERE key=?", (key,))
+    _settings_memo.forget()
 
 
-def get_setting(key: str, default: str = "") -> str:
-    """Return the setting value: UI override first, then env var, then default."""
-    data = load_app_settings()
+def get_setting(key: str, default: str = "", settings: Optional[dict] = None) -> str:
+    """Return the setting value: UI override first, then env var, then default.
+
+    Pass `settings` (from load_app_settings) when reading several keys, so the
+    table is only queried once.
+    """
+    data = _app_settings() if settings is None else settings
     return data.get(key) or os.getenv(key, default)
 
 
@@ -355,11 +717,11 @@ _UI_DEFAULTS: dict = {
 }
 
 
+@functools.lru_cache(maxsize=32)
 def _hex_lighten(hex_color: str, factor: float = 0.13) -> str:
     """Return a lightened version of a hex color (mix toward white)."""
     try:
-        h = hex_color.lstrip("#")
-        r, g, b = int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16)
+        r, g, b = bytes.fromhex(hex_color.lstrip("#")[:6])
         r = min(255, int(r + (255 - r) * factor))
         g = min(255, int(g + (255 - g) * factor))
         b = min(255, int(b + (255 - b) * factor))
@@ -368,12 +730,12 @@ def _hex_lighten(hex_color: str, factor: float = 0.13) -> str:
         return hex_color
 
 
+@functools.lru_cache(maxsize=32)
 def _hex_tint_bg(hex_color: str, surface: str = "#0d1117", t: float = 0.12) -> str:
     """Mix accent into dark surface to produce a subtle tinted background."""
     try:
-        h1, h2 = hex_color.lstrip("#"), surface.lstrip("#")
-        r1, g1, b1 = int(h1[0:2], 16), int(h1[2:4], 16), int(h1[4:6], 16)
-        r2, g2, b2 = int(h2[0:2], 16), int(h2[2:4], 16), int(h2[4:6], 16)
+        r1, g1, b1 = bytes.fromhex(hex_color.lstrip("#")[:6])
+        r2, g2, b2 = bytes.fromhex(surface.lstrip("#")[:6])
         r = int(r1 * t + r2 * (1 - t))
         g = int(g1 * t + g2 * (1 - t))
         b = int(b1 * t + b2 * (1 - t))
@@ -382,11 +744,18 @@ def _hex_tint_bg(hex_color: str, surface: str = "#0d1117", t: float = 0.12) -> s
         return "#0d1e2d"
 
 
-def load_ui_config() -> dict:
+def _read_ui_config() -> dict:
     with _db() as con:
         rows = con.execute("SELECT key, value FROM ui_config").fetchall()
-    stored = {r["key"]: r["value"] for r in rows}
-    return {**_UI_DEFAULTS, **stored}
+    return {**_UI_DEFAULTS, **{r["key"]: r["value"] for r in rows}}
+
+
+_ui_memo = _TableMemo(_read_ui_config)
+
+
+def load_ui_config() -> dict:
+    # Callers add derived keys to the result, so never hand out the cached dict
+    return dict(_ui_memo.get())
 
 
 def save_ui_config(updates: dict):
@@ -395,8 +764,11 @@ def save_ui_config(updates: dict):
         stripped = v.strip()
         current[k] = stripped if stripped else _UI_DEFAULTS.get(k, "")
     with _db() as con:
-        for k, v in current.items():
-            con.execute("INSERT INTO ui_config VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (k, v))
+        con.executemany(
+            "INSERT INTO ui_config VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            current.items(),
+        )
+    _ui_memo.forget()
 
 
 def get_ui_context() -> dict:
@@ -422,48 +794,92 @@ def get_ui_context() -> dict:
 # ---------------------------------------------------------------------------
 
 
+# PBKDF2 runs inside OpenSSL, which uses SHA extensions where the CPU has them.
+# Changing the count invalidates every stored hash, so it stays fixed.
+PW_HASH_ITERATIONS = 100_000
+
+
+def _pw_digest(password: str, salt: str) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), PW_HASH_ITERATIONS)
+
+
 def _hash_pw(password: str, salt: str) -> str:
-    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), 100_000).hex()
+    return _pw_digest(password, salt).hex()
+
+
+def _stored_digest(pw_hash: str) -> bytes:
+    """Raw digest of a stored hex hash; a malformed value can never match."""
+    try:
+        return bytes.fromhex(pw_hash or "")
+    except ValueError:
+        return b""
+
+
+# Hashed against when the username is unknown, so timing doesn't reveal which users exist
+_DUMMY_SALT = uuid.uuid4().hex
+
+
+def _read_user_hashes() -> dict[str, tuple[bytes, str]]:
+    with _db() as con:
+        rows = con.execute("SELECT username, hash, salt FROM users").fetchall()
+    return {r["username"]: (_stored_digest(r["hash"]), r["salt"]) for r in rows}
+
+
+# username -> (raw digest, salt); loaded on first login, dropped whenever users change
+_users_memo = _TableMemo(_read_user_hashes)
+
+
+def _user_hashes() -> dict[str, tuple[bytes, str]]:
+    return _users_memo.get()
+
+
+def _forget_users():
+    _users_memo.forget()
 
 
 def bootstrap_users() -> Optional[str]:
     """Init DB, migrate legacy JSON data, create admin user on first run.
 
     Returns the generated password (printed once to logs), or None if
-    at least one user already exists.
+    at least one user already exists. Holds an exclusive lock on
+    DB_DIR/.bootstrap.lock so concurrent starts can't both create an admin.
     """
-    _init_db()
-    with _db() as con:
-        count = con.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    if count > 0:
-        return None
-    password = secrets.token_urlsafe(16)
-    salt = uuid.uuid4().hex
-    with _db() as con:
-        con.execute("INSERT INTO users VALUES (?,?,?)", ("admin", _hash_pw(password, salt), salt))
-    return password
+    _ensure_dirs()
+    with open(os.path.join(DB_DIR, ".bootstrap.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _init_db()
+        with _db() as con:
+            count = con.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            if count > 0:
+                return None
+            password = secrets.token_urlsafe(16)
+            salt = uuid.uuid4().hex
+            con.execute("INSERT INTO users VALUES (?,?,?)", ("admin", _hash_pw(password, salt), salt))
+        _forget_users()
+        return password
 
 
 def change_password(username: str, new_password: str) -> Optional[str]:
     """Change password for an existing user. Returns an error string or None on success."""
     if not new_password or len(new_password) < 6:
         return "Password must be at least 6 characters."
-    with _db() as con:
-        row = con.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone()
-    if not row:
-        return f"User '{username}' not found."
     salt = uuid.uuid4().hex
+    pw_hash = _hash_pw(new_password, salt)   # hashed before borrowing a connection
     with _db() as con:
-        con.execute("UPDATE users SET hash=?, salt=? WHERE username=?", (_hash_pw(new_password, salt), salt, username))
+        cur = con.execute("UPDATE users SET hash=?, salt=? WHERE username=?", (pw_hash, salt, username))
+    if cur.rowcount == 0:
+        return f"User '{username}' not found."
+    _forget_users()
     return None
 
 
 def verify_user(username: str, password: str) -> bool:
-    with _db() as con:
-        row = con.execute("SELECT hash, salt FROM users WHERE username=?", (username,)).fetchone()
-    if not row:
+    stored = _user_hashes().get(username)
+    if stored is None:
+        _pw_digest(password, _DUMMY_SALT)
         return False
-    return _hmac.compare_digest(_hash_pw(password, row["salt"]), row["hash"])
+    digest, salt = stored
+    return _hmac.compare_digest(_pw_digest(password, salt), digest)
 
 
 def list_users() -> list[str]:
@@ -477,17 +893,18 @@ def add_user(username: str, password: str) -> Optional[str]:
     username = username.strip()
     if not username or not password:
         return "Username and password are required."
-    with _db() as con:
-        existing = con.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone()
-    if existing:
-        return f"User '{username}' already exists."
     salt = uuid.uuid4().hex
+    pw_hash = _hash_pw(password, salt)
     with _db() as con:
-        con.execute("INSERT INTO users VALUES (?,?,?)", (username, _hash_pw(password, salt), salt))
+        cur = con.execute("INSERT OR IGNORE INTO users VALUES (?,?,?)", (username, pw_hash, salt))
+    if cur.rowcount == 0:
+        return f"User '{username}' already exists."
+    _forget_users()
     return None
 
 
 def delete_user(username: str) -> bool:
     with _db() as con:
         cur = con.execute("DELETE FROM users WHERE username=?", (username,))
+    _forget_users()
     return cur.rowcount > 0
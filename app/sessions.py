@@ -0,0 +1,94 @@
+"""Server-side sessions stored in SQLite.
+
+Drop-in replacement for Starlette's SessionMiddleware: `request.session` works
+the same, but the cookie only carries a signed random session id. The session
+dict itself (GitHub OAuth token included) never leaves the server, and the
+cookie stays under 100 bytes however much the session holds.
+"""
+import secrets
+import time
+from typing import Optional
+
+import itsdangerous
+from itsdangerous.exc import BadSignature
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import models
+
+_PURGE_EVERY = 3600
+
+
+class ServerSessionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret_key: str,
+        session_cookie: str = "session",
+        max_age: int = 86400,
+        same_site: str = "lax",
+        https_only: bool = False,
+    ):
+        self.app = app
+        # Signing the id keeps SESSION_SECRET meaningful: rotating it logs everyone out
+        self.signer = itsdangerous.Signer(str(secret_key))
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+        self._last_purge = 0.0
+
+    def _load(self, cookie: Optional[str]) -> tuple[Optional[str], dict, float]:
+        """Return (session id, data, expires) for a cookie; (None, {}, 0) if invalid."""
+        if not cookie:
+            return None, {}, 0.0
+        try:
+            sid = self.signer.unsign(cookie).decode()
+        except BadSignature:
+            return None, {}, 0.0
+        stored = models.load_session(sid)
+        if stored is None:
+            return None, {}, 0.0
+        data, expires = stored
+        return sid, data, expires
+
+    def _cookie(self, value: str, max_age: Optional[int]) -> str:
+        lifetime = f"Max-Age={max_age}; " if max_age else "expires=Thu, 01 Jan 1970 00:00:00 GMT; "
+        return f"{self.session_cookie}={value}; path=/; {lifetime}{self.security_flags}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        connection = HTTPConnection(scope)
+        sid, data, expires = self._load(connection.cookies.get(self.session_cookie))
+        initial = dict(data)
+        scope["session"] = data
+
+        async def send_wrapper(message: Message):
+            nonlocal sid
+            if message["type"] == "http.response.start":
+                session = scope["session"]
+                now = time.time()
+                headers = MutableHeaders(scope=message)
+                if session:
+                    # Write only on change, or to slide the expiry once half used up
+                    if sid is None or session != initial or expires - now < self.max_age / 2:
+                        if sid is None:
+                            sid = secrets.token_urlsafe(32)
+                        models.save_session(sid, session, now + self.max_age)
+                        signed = self.signer.sign(sid).decode()
+                        headers.append("Set-Cookie", self._cookie(signed, self.max_age))
+                elif sid is not None:
+                    # The session has been cleared (logout)
+                    models.delete_session(sid)
+                    headers.append("Set-Cookie", self._cookie("null", None))
+                if now - self._last_purge > _PURGE_EVERY:
+                    self._last_purge = now
+                    models.purge_sessions()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,8 +1,10 @@
 """Signature verification and plain-env helpers."""
+import functools
 import hashlib
 import hmac
 import os
-from typing import Optional
+import re
+from typing import Iterator, Optional
 
 from fastapi import HTTPException, status
 
@@ -11,9 +13,34 @@ from fastapi import HTTPException, status
 # GitHub signature
 # ---------------------------------------------------------------------------
 
-def verify_signature(signature_header: Optional[str], body: bytes):
+_SIG_HEX_LEN = 2 * hashlib.sha256().digest_size
+
+# (stored value, encoded bytes) — re-encoded only when the secret changes
+_secret_cache: tuple[str, bytes] = ("", b"")
+
+
+def _webhook_secret() -> bytes:
+    """Current webhook secret as bytes.
+
+    get_setting() serves from the memoised app_settings table, and
+    save_app_setting() resets that memo — so a new secret applies on the next
+    webhook without a DB read per request or a separate invalidation hook.
+    """
+    global _secret_cache
     from app.models import get_setting
-    secret = get_setting("GITHUB_WEBHOOK_SECRET", "").encode()
+    value = get_setting("GITHUB_WEBHOOK_SECRET", "")
+    if value != _secret_cache[0]:
+        _secret_cache = (value, value.encode())
+    return _secret_cache[1]
+
+
+def verify_signature(signature_header: Optional[str], body: bytes):
+    """Check X-Hub-Signature-256 against the raw body.
+
+    Runs before the payload is parsed or queued, so forged requests cost only
+    an HMAC over the body and never reach json.loads.
+    """
+    secret = _webhook_secret()
 
     if not signature_header:
         if not secret:
@@ -27,8 +54,18 @@ def verify_signature(signature_header: Optional[str], body: bytes):
     if len(parts) != 2 or parts[0] != "sha256":
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             detail="Unsupported signature algorithm")
-    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
-    if not hmac.compare_digest(expected, parts[1]):
+    # A malformed digest can never match — reject it before hashing the body
+    if len(parts[1]) != _SIG_HEX_LEN:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid signature")
+    try:
+        provided = bytes.fromhex(parts[1])
+    except ValueError:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid signature")
+    # One-shot OpenSSL HMAC; compare raw digests rather than hex strings
+    expected = hmac.digest(secret, body, "sha256")
+    if not hmac.compare_digest(expected, provided):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid signature")
 
@@ -37,21 +74,24 @@ def verify_signature(signature_header: Optional[str], body: bytes):
 # Plain .env parser
 # ---------------------------------------------------------------------------
 
-def parse_env_file(content: str) -> dict[str, str]:
-    """Parse a plain KEY=VALUE .env file into a dict.
+# One KEY=VALUE line: leading/trailing blanks ignored, "#" lines skipped,
+# value optionally wrapped in matching quotes (group 2 or 3, else group 4)
+_ENV_RE = re.compile(
+    r"""^[^\S\n]*([^#=\s][^=\n]*?)[^\S\n]*=[^\S\n]*"""
+    r"""(?:"(.*)"|'(.*)'|(.*?))[^\S\n]*$""",
+    re.M,
+)
+
+
+def parse_env_file(content: str) -> Iterator[tuple[str, str]]:
+    """Yield (KEY, VALUE) pairs from a plain KEY=VALUE .env file.
     Skips blank lines and comments (#). Strips surrounding quotes from values.
     """
-    result = {}
-    for line in content.splitlines():
-        line = line.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        key, _, val = line.partition("=")
-        key = key.strip()
-        val = val.strip()
-        # Strip matching surrounding quotes
-        if len(val) >= 2 and val[0] in ('"', "'") and val[-1] == val[0]:
-            val = val[1:-1]
-        if key:
-            result[key] = val
-    return result
+    for m in _ENV_RE.finditer(content):
+        yield m[1], m[m.lastindex]
+
+
+@functools.lru_cache(maxsize=256)
+def env_pairs(content: str) -> tuple[tuple[str, str], ...]:
+    """Cached, de-duplicated parse_env_file() result (last value for a key wins)."""
+    return tuple(dict(parse_env_file(content)).items())